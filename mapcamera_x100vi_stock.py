@@ -4,18 +4,33 @@
 from __future__ import annotations
 
 import argparse
+import codecs
+import hashlib
 import json
+import os
 import re
 import sys
+import tempfile
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+from email.message import Message
 from html import unescape
-from typing import Iterable
+from http.client import HTTPResponse
+from typing import Iterable, Iterator
 from urllib.error import HTTPError, URLError
 from urllib.request import Request, urlopen
 
 DEFAULT_URL = "https://www.mapcamera.com/search?keyword=X100VI"
 DEFAULT_TIMEOUT = 20
 DEFAULT_WINDOW = 180
+DEFAULT_CONCURRENCY = 4
+READ_CHUNK_SIZE = 64 * 1024
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "x100vi",
+)
 
 IN_STOCK_KEYWORDS = (
     "在庫あり",
@@ -48,6 +63,23 @@ SCHEMA_OUT_OF_STOCK_KEYWORDS = (
     "soldout",
 )
 
+# コメント/script/style の除去と JSON-LD の取り出しは1パスで行う
+# （コメント中の ">" や "<script>" でタグ除去が崩れないよう、コメントは丸ごと落とす。
+#   ブラウザと同じく "<!-->" "<!--->" はその場で閉じた空コメントとして扱う。
+#   "<scripts>" "<script-loader>" などを script と誤認しないよう、タグ名の直後も確認する）
+_RE_NON_TEXT = re.compile(
+    r"<!--(?:>|->|[\s\S]*?-->)|<script(?=[\s/>])([^>]*)>([\s\S]*?)</script>|<style(?=[\s/>])[\s\S]*?</style>",
+    re.IGNORECASE,
+)
+_RE_TAG = re.compile(r"<[^>]+>")
+_RE_X100VI = re.compile(r"X100\s*VI", re.IGNORECASE)
+_RE_TITLE_LINE = re.compile(r"[^\n]*X100\s*VI[^\n]*", re.IGNORECASE)
+_RE_MAX_AGE = re.compile(r"max-age=(\d+)", re.IGNORECASE)
+_RE_LDJSON_TYPE = re.compile(r"type=[\"']application/ld\+json[\"']", re.IGNORECASE)
+
+# IGNORECASE では i/s に一致するが lower() では一致しない文字（iter_keyword_spans で使用）
+_CASEFOLD_EXCEPTIONS = ("\u0130", "\u0131", "\u017f")
+
 
 @dataclass
 class ProductStatus:
@@ -64,7 +96,114 @@ def stock_label(value: bool | None) -> str:
     return "unknown"
 
 
-def fetch_html(url: str, timeout: int) -> str:
+def cache_paths(cache_dir: str, url: str) -> tuple[str, str]:
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"{key}.meta.json"), os.path.join(cache_dir, f"{key}.html")
+
+
+def load_cache(cache_dir: str, url: str) -> tuple[dict, str] | None:
+    meta_path, body_path = cache_paths(cache_dir, url)
+    try:
+        with open(meta_path, "r", encoding="utf-8") as fp:
+            meta = json.load(fp)
+        with open(body_path, "r", encoding="utf-8") as fp:
+            body = fp.read()
+    except (OSError, ValueError):
+        return None
+    if not isinstance(meta, dict) or meta.get("url") != url:
+        return None
+    return meta, body
+
+
+def write_atomic(path: str, text: str) -> None:
+    # 同じディレクトリの一時ファイルに書いてから置き換え、書きかけのファイルを残さない
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            fp.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def store_cache(cache_dir: str, url: str, meta: dict, body: str | None = None) -> None:
+    # キャッシュは補助的なものなので、書き込み失敗は無視して取得結果を優先する
+    meta_path, body_path = cache_paths(cache_dir, url)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # 本文を先に、メタ情報（ETag など）を最後に置き換える
+        if body is not None:
+            write_atomic(body_path, body)
+        write_atomic(meta_path, json.dumps(meta, ensure_ascii=False))
+    except OSError:
+        pass
+
+
+def remove_cache(cache_dir: str, url: str) -> None:
+    # メタ情報を先に消し、本文だけが残っても使われないようにする
+    for path in cache_paths(cache_dir, url):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def cache_max_age(headers: Message) -> int:
+    cache_control = headers.get("Cache-Control") or ""
+    if "no-cache" in cache_control.lower():
+        return 0
+    match = _RE_MAX_AGE.search(cache_control)
+    return int(match.group(1)) if match else 0
+
+
+def read_body(res: HTTPResponse) -> str:
+    # 受信しながら展開・デコードし、圧縮前後の本文全体を同時に抱えないようにする
+    charset = res.headers.get_content_charset() or "utf-8"
+    decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    inflater = None
+    if (res.headers.get("Content-Encoding") or "").lower() == "gzip":
+        inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+    parts: list[str] = []
+    received = False
+    while True:
+        chunk = res.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        if inflater is None:
+            parts.append(decoder.decode(chunk))
+            continue
+        received = True
+        # 複数メンバーの gzip は、前のメンバーの後ろに残ったデータから展開し直す
+        # （メンバー間や末尾のゼロ埋めは gzip.decompress と同様に読み飛ばす）
+        while chunk:
+            parts.append(decoder.decode(inflater.decompress(chunk)))
+            chunk = b""
+            if inflater.eof:
+                chunk = inflater.unused_data.lstrip(b"\0")
+                if chunk:
+                    inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if inflater is not None:
+        parts.append(decoder.decode(inflater.flush()))
+        if received and not inflater.eof:
+            # 途中で切れた gzip を部分的なHTMLとして扱う（キャッシュもされる）と判定を誤るのでエラーにする
+            raise EOFError("gzip で圧縮された本文が途中で終わっています")
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts)
+
+
+def fetch_html(url: str, timeout: int, cache_dir: str | None = None) -> str:
+    cached = load_cache(cache_dir, url) if cache_dir else None
+    if cached:
+        meta, body = cached
+        # max-age 内ならネットワークに出ずにキャッシュを返す
+        if time.time() - meta.get("fetched_at", 0) < meta.get("max_age", 0):
+            return body
+
     req = Request(
         url,
         headers={
@@ -72,22 +211,55 @@ def fetch_html(url: str, timeout: int) -> str:
                 "Mozilla/5.0 (X11; Linux x86_64) "
                 "AppleWebKit/537.36 (KHTML, like Gecko) "
                 "Chrome/123.0.0.0 Safari/537.36"
-            )
+            ),
+            # HTMLはgzipで数分の一になるので、圧縮転送を受け付ける
+            "Accept-Encoding": "gzip",
         },
     )
-    with urlopen(req, timeout=timeout) as res:
-        charset = res.headers.get_content_charset() or "utf-8"
-        return res.read().decode(charset, errors="replace")
+    if cached:
+        if meta.get("etag"):
+            req.add_header("If-None-Match", meta["etag"])
+        if meta.get("last_modified"):
+            req.add_header("If-Modified-Since", meta["last_modified"])
+
+    try:
+        with urlopen(req, timeout=timeout) as res:
+            html = read_body(res)
+            headers = res.headers
+    except HTTPError as exc:
+        if exc.code != 304 or not cached:
+            raise
+        # 304 Not Modified: 保存済みの本文をそのまま使う
+        meta.update(fetched_at=time.time(), max_age=cache_max_age(exc.headers))
+        store_cache(cache_dir, url, meta)
+        return body
+
+    if cache_dir:
+        meta = {
+            "url": url,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "fetched_at": time.time(),
+            "max_age": cache_max_age(headers),
+        }
+        no_store = "no-store" in (headers.get("Cache-Control") or "").lower()
+        # 検証子も max-age もない応答は次回使えないので、保存せず古いエントリも消す
+        if no_store or not (meta["etag"] or meta["last_modified"] or meta["max_age"] > 0):
+            remove_cache(cache_dir, url)
+        else:
+            store_cache(cache_dir, url, meta, html)
+    return html
 
 
 def normalize_text(value: str) -> str:
     text = unescape(value)
-    text = re.sub(r"<[^>]+>", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
+    text = _RE_TAG.sub(" ", text)
+    # 空白の畳み込みは正規表現より str.split/join の方が速い
+    return " ".join(text.split())
 
 
 def detect_stock(text: str) -> bool | None:
+    # 抜粋は数百文字程度なので、キーワードを連結した正規表現より `in` の逐次判定の方が速い
     lower = text.lower()
 
     for kw in SCHEMA_IN_STOCK_KEYWORDS:
@@ -106,85 +278,149 @@ def detect_stock(text: str) -> bool | None:
     return None
 
 
-def find_keyword_contexts(text: str, keyword_pattern: str, window: int) -> list[str]:
+def compile_keyword(keyword_pattern: str | re.Pattern[str]) -> re.Pattern[str]:
+    if isinstance(keyword_pattern, re.Pattern):
+        return keyword_pattern
+    return re.compile(keyword_pattern, flags=re.IGNORECASE)
+
+
+def iter_keyword_spans(text: str, keyword_re: re.Pattern[str]) -> Iterator[tuple[int, int]]:
+    literal = keyword_re.pattern
+    if literal and literal.isascii() and re.escape(literal) == literal:
+        # メタ文字を含まない ASCII キーワードは正規表現を使わず str.find で探す
+        haystack: str | None = text
+        if keyword_re.flags & re.IGNORECASE:
+            # "İ" "ı" "ſ" は IGNORECASE で i/s に一致するが lower() では一致しない（長さも変わりうる）ので、
+            # 含まれる場合は正規表現に任せる
+            if any(ch in text for ch in _CASEFOLD_EXCEPTIONS):
+                haystack = None
+            else:
+                haystack = text.lower()
+                literal = literal.lower()
+        if haystack is not None:
+            pos = haystack.find(literal)
+            while pos >= 0:
+                yield pos, pos + len(literal)
+                pos = haystack.find(literal, pos + len(literal))
+            return
+    for match in keyword_re.finditer(text):
+        yield match.span()
+
+
+def find_keyword_contexts(text: str, keyword_pattern: str | re.Pattern[str], window: int) -> list[str]:
+    # 先に範囲だけで重複を除き、切り出しは残ったものだけ行う
+    spans: dict[tuple[int, int], None] = {}
+    for start, end in iter_keyword_spans(text, compile_keyword(keyword_pattern)):
+        spans[(max(0, start - window), min(len(text), end + window))] = None
+
     contexts: list[str] = []
-    for match in re.finditer(keyword_pattern, text, flags=re.IGNORECASE):
-        start = max(0, match.start() - window)
-        end = min(len(text), match.end() + window)
+    for start, end in spans:
         snippet = text[start:end].strip()
         if snippet:
             contexts.append(snippet)
     return contexts
 
 
-def extract_json_product_candidates(html: str) -> list[str]:
+def split_scripts(html: str) -> tuple[str, list[str]]:
+    # コメント/script/style を落とした HTML と JSON-LD の中身を、1回の走査でまとめて得る
+    # split の結果は [本文, scriptの属性, scriptの中身, 本文, ...] の3つ組になる
+    # （コメント/style の箇所では属性と中身が None）
+    pieces = _RE_NON_TEXT.split(html)
+    ldjson_bodies = [
+        body for attrs, body in zip(pieces[1::3], pieces[2::3]) if attrs and _RE_LDJSON_TYPE.search(attrs)
+    ]
+    return " ".join(pieces[::3]), ldjson_bodies
+
+
+def extract_json_product_candidates(ldjson_bodies: Iterable[str]) -> list[str]:
     candidates: list[str] = []
-    for raw in re.findall(
-        r"<script[^>]*type=[\"']application/ld\+json[\"'][^>]*>([\s\S]*?)</script>",
-        html,
-        flags=re.IGNORECASE,
-    ):
+    found: list[str] = []
+    # 同じ商品名が Product/Offer などで何度も現れるので、正規化結果を使い回す
+    normalized: dict[str, str] = {}
+
+    # デコード中に生成される dict をその場で調べ、木全体を再帰で辿り直さない
+    def collect(item: dict) -> dict:
+        name = str(item.get("name", ""))
+        # "100" は大文字小文字の影響を受けないので、正規表現の前の安価な足切りに使える
+        if name and "100" in name and _RE_X100VI.search(name):
+            avail = str(item.get("availability", ""))
+            raw_candidate = f"{name} {avail}"
+            if raw_candidate not in normalized:
+                normalized[raw_candidate] = normalize_text(raw_candidate)
+            found.append(normalized[raw_candidate])
+        return item
+
+    for raw in ldjson_bodies:
         body = raw.strip()
         if not body:
             continue
+        found.clear()
         try:
-            payload = json.loads(body)
-        except json.JSONDecodeError:
+            json.loads(body, object_hook=collect)
+        except (json.JSONDecodeError, RecursionError):
+            # 壊れたJSONや極端に深いネストのブロックは読み飛ばす
             continue
-
-        def walk(node: object) -> Iterable[dict]:
-            if isinstance(node, dict):
-                yield node
-                for v in node.values():
-                    yield from walk(v)
-            elif isinstance(node, list):
-                for item in node:
-                    yield from walk(item)
-
-        for item in walk(payload):
-            name = str(item.get("name", ""))
-            avail = str(item.get("availability", ""))
-            if not name:
-                continue
-            if re.search(r"X100\s*VI", name, flags=re.IGNORECASE):
-                raw_candidate = f"{name} {avail}".strip()
-                candidates.append(raw_candidate)
+        candidates.extend(found)
     return candidates
 
 
-def build_statuses(html: str, keyword_pattern: str, window: int) -> list[ProductStatus]:
-    # script/styleを落とした通常テキスト
-    reduced_html = re.sub(r"<script[\s\S]*?</script>", " ", html, flags=re.IGNORECASE)
-    reduced_html = re.sub(r"<style[\s\S]*?</style>", " ", reduced_html, flags=re.IGNORECASE)
+def build_statuses(
+    html: str,
+    keyword_pattern: str | re.Pattern[str],
+    window: int,
+    early_exit: bool = False,
+) -> list[ProductStatus]:
+    # コメント/script/styleを落とした通常テキストと、JSON-LD の中身
+    reduced_html, ldjson_bodies = split_scripts(html)
     plain_text = normalize_text(reduced_html)
 
     contexts = find_keyword_contexts(plain_text, keyword_pattern, window)
 
     # 構造化データからも拾う（検索結果が動的生成でも最低限ヒントを取る）
-    contexts.extend(extract_json_product_candidates(html))
+    contexts.extend(extract_json_product_candidates(ldjson_bodies))
 
+    # どちらも正規化済みなので、ここでは重複除去のみ行う
     uniq: list[str] = []
     seen: set[str] = set()
     for c in contexts:
-        norm = normalize_text(c)
-        if not norm or norm in seen:
+        if not c or c in seen:
             continue
-        seen.add(norm)
-        uniq.append(norm)
+        seen.add(c)
+        uniq.append(c)
 
     statuses: list[ProductStatus] = []
     for snippet in uniq:
-        title_match = re.search(r"[^\n]*X100\s*VI[^\n]*", snippet, flags=re.IGNORECASE)
+        title_match = _RE_TITLE_LINE.search(snippet) if "100" in snippet else None
         title = title_match.group(0).strip() if title_match else "X100VI"
         statuses.append(ProductStatus(title=title[:140], snippet=snippet[:220], in_stock=detect_stock(snippet)))
+        if early_exit and statuses[-1].in_stock is True:
+            # 終了コードだけ必要な場合は、在庫ありが1件見つかった時点で残りの判定を省く
+            break
 
     return statuses
 
 
-def summarize(statuses: list[ProductStatus], keyword_label: str, as_json: bool = False) -> int:
+def summarize(
+    statuses: list[ProductStatus],
+    keyword_label: str,
+    as_json: bool = False,
+    quiet: bool = False,
+    source: str | None = None,
+) -> int:
+    if quiet:
+        if not statuses:
+            return 2
+        return 0 if any(s.in_stock is True for s in statuses) else 1
+
+    # 複数URLをまとめて確認する場合は、どのURLの結果かを併記する
+    source_info = {"url": source} if source else {}
+    if source and not as_json:
+        print(f"--- {source} ---")
+
     if not statuses:
         if as_json:
-            print(json.dumps({"keyword": keyword_label, "statuses": [], "result": "not_found"}, ensure_ascii=False))
+            payload = {"keyword": keyword_label, **source_info, "statuses": [], "result": "not_found"}
+            print(json.dumps(payload, ensure_ascii=False))
         else:
             print(f"{keyword_label} を含む商品情報が見つかりませんでした。URLやページ構造を確認してください。")
         return 2
@@ -194,6 +430,7 @@ def summarize(statuses: list[ProductStatus], keyword_label: str, as_json: bool =
     if as_json:
         payload = {
             "keyword": keyword_label,
+            **source_info,
             "result": "in_stock_detected" if has_in_stock else "in_stock_not_detected",
             "statuses": [
                 {"title": s.title, "snippet": s.snippet, "stock": stock_label(s.in_stock)} for s in statuses
@@ -221,14 +458,50 @@ def summarize(statuses: list[ProductStatus], keyword_label: str, as_json: bool =
     return 1
 
 
+def check_url(
+    url: str,
+    keyword_re: re.Pattern[str],
+    window: int,
+    timeout: int,
+    cache_dir: str | None,
+    early_exit: bool = False,
+) -> tuple[list[ProductStatus] | None, str | None]:
+    # ワーカースレッドで取得から解析まで行い、エラーは表示用の文言として返す
+    try:
+        html = fetch_html(url, timeout, cache_dir=cache_dir)
+    except HTTPError as exc:
+        return None, f"HTTPエラー: {exc.code} {exc.reason}"
+    except URLError as exc:
+        return None, f"URLエラー: {exc.reason}"
+    except Exception as exc:  # noqa: BLE001
+        return None, f"取得エラー: {exc}"
+    return build_statuses(html, keyword_re, window, early_exit=early_exit), None
+
+
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="MapCameraでX100VIの在庫状況を確認")
-    parser.add_argument("--url", default=DEFAULT_URL, help=f"チェック対象URL (default: {DEFAULT_URL})")
+    parser.add_argument(
+        "--url",
+        action="append",
+        help=f"チェック対象URL。複数回指定すると並行して取得する (default: {DEFAULT_URL})",
+    )
     parser.add_argument("--html-file", help="ローカルHTMLファイルを読み込んで解析（ネットワーク取得をスキップ）")
     parser.add_argument("--keyword", default="X100VI", help="商品キーワード（正規表現）。default: X100VI")
     parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="HTTPタイムアウト秒")
     parser.add_argument("--window", type=int, default=DEFAULT_WINDOW, help="キーワード前後の抽出文字数")
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=DEFAULT_CONCURRENCY,
+        help="複数URL指定時の同時取得数",
+    )
     parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    parser.add_argument("--quiet", action="store_true", help="何も出力せず終了コードのみ返す")
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help=f"HTTPキャッシュ（{DEFAULT_CACHE_DIR}）を使わずに毎回取得する",
+    )
     return parser.parse_args()
 
 
@@ -236,7 +509,7 @@ def main() -> int:
     args = parse_args()
 
     try:
-        re.compile(args.keyword, flags=re.IGNORECASE)
+        keyword_re = compile_keyword(args.keyword)
     except re.error as exc:
         print(f"キーワード正規表現エラー: {exc}", file=sys.stderr)
         return 4
@@ -245,28 +518,46 @@ def main() -> int:
         print("--window は 0 以上を指定してください", file=sys.stderr)
         return 4
 
+    if args.concurrency < 1:
+        print("--concurrency は 1 以上を指定してください", file=sys.stderr)
+        return 4
+
     if args.html_file:
         try:
-            with open(args.html_file, "r", encoding="utf-8", errors="replace") as fp:
-                html = fp.read()
+            # テキストモードの改行変換を挟まず、バイト列を一度だけデコードする
+            with open(args.html_file, "rb") as fp:
+                html = fp.read().decode("utf-8", errors="replace")
         except OSError as exc:
             print(f"ローカルHTML読み込みエラー: {exc}", file=sys.stderr)
             return 3
-    else:
-        try:
-            html = fetch_html(args.url, args.timeout)
-        except HTTPError as exc:
-            print(f"HTTPエラー: {exc.code} {exc.reason}", file=sys.stderr)
-            return 3
-        except URLError as exc:
-            print(f"URLエラー: {exc.reason}", file=sys.stderr)
-            return 3
-        except Exception as exc:  # noqa: BLE001
-            print(f"取得エラー: {exc}", file=sys.stderr)
-            return 3
 
-    statuses = build_statuses(html, args.keyword, args.window)
-    return summarize(statuses, args.keyword, as_json=args.json)
+        statuses = build_statuses(html, keyword_re, args.window, early_exit=args.quiet)
+        return summarize(statuses, args.keyword, as_json=args.json, quiet=args.quiet)
+
+    urls = args.url or [DEFAULT_URL]
+    cache_dir = None if args.no_cache else DEFAULT_CACHE_DIR
+    with ThreadPoolExecutor(max_workers=min(args.concurrency, len(urls))) as pool:
+        futures = [
+            pool.submit(check_url, url, keyword_re, args.window, args.timeout, cache_dir, args.quiet) for url in urls
+        ]
+        results = [future.result() for future in futures]
+
+    codes: list[int] = []
+    for url, (statuses, error) in zip(urls, results):
+        if statuses is None:
+            print(error if len(urls) == 1 else f"{url}: {error}", file=sys.stderr)
+            codes.append(3)
+            continue
+        source = url if len(urls) > 1 else None
+        codes.append(summarize(statuses, args.keyword, as_json=args.json, quiet=args.quiet, source=source))
+
+    # 在庫ありを検出したURLがあれば 0。なければ取得失敗を 3 として優先し、
+    # 残りは最も良い結果（1: 在庫あり表記なし < 2: 商品情報なし）を返す
+    if 0 in codes:
+        return 0
+    if 3 in codes:
+        return 3
+    return min(codes)
 
 
 if __name__ == "__main__":